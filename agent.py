@@ -5,40 +5,106 @@
 его очистки и передачи в модуль OpenAI для создания резюме.
 """
 
+import os
+import codecs
+import hashlib
+import itertools
 import logging
-import requests
-from typing import Optional
+import threading
+import time
+import httpx
+from concurrent.futures import Future
+from typing import Dict, Iterable, List, Optional, Union
 from urllib.parse import urlparse
-from bs4 import BeautifulSoup, Tag
+from lxml import etree
+
+try:
+    from selectolax.lexbor import LexborHTMLParser
+except ImportError:
+    LexborHTMLParser = None
+
+try:
+    import tiktoken
+except ImportError:
+    tiktoken = None
 
 from openai_module import summarize_text
 from ollama_module import summarize_text as ollama_summarize_text
+from summary_cache import summary_cache
 
-# Настройка логирования
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
-)
 logger = logging.getLogger(__name__)
 
+if tiktoken is None:
+    logger.warning("tiktoken не установлен, текст обрезается по числу символов")
+
 # Константы
-MAX_TEXT_LENGTH = 5000
+MAX_PROMPT_TOKENS = int(os.getenv("MAX_PROMPT_TOKENS", "3000"))
+MAX_TEXT_LENGTH = 5000  # Лимит в символах, если tiktoken недоступен
+TOKENIZER_MODEL = "gpt-4o"
 DEFAULT_TIMEOUT = 10
 USER_AGENT = "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36"
+CHUNK_SIZE = 16384  # Размер блока при потоковой загрузке страницы
+# Служебные теги, текст которых не попадает в резюме
+STRIP_TAGS = frozenset({
+    "script", "style", "nav", "footer", "header", "noscript", "svg", "iframe"
+})
+_STRIP_SELECTOR = 'script, style, nav, footer, header, noscript, svg, iframe'
+# Теги с основным текстом страницы (потоковый парсер собирает текст только из них)
+CONTENT_TAGS = frozenset({
+    "p", "h1", "h2", "h3", "h4", "li", "article", "section", "main", "blockquote", "td"
+})
+
+# Парсер HTML: "selectolax" (быстрый, по умолчанию) или "lxml" (потоковый)
+HTML_PARSER = os.getenv("HTML_PARSER", "selectolax").lower()
 
 
-def fetch_url_content(url: str) -> Optional[str]:
+def _create_client() -> httpx.Client:
     """
-    Загружает HTML-контент с указанного URL.
+    Создает HTTP-клиент с HTTP/2, keep-alive и пулом соединений.
+    
+    Returns:
+        Настроенный клиент httpx
+    """
+    limits = httpx.Limits(max_connections=20, max_keepalive_connections=20)
+    # Транспорт повторяет только неудачные попытки соединения
+    transport = httpx.HTTPTransport(http2=True, limits=limits, retries=3)
+    
+    return httpx.Client(
+        transport=transport,
+        headers={
+            'User-Agent': USER_AGENT,
+            'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8',
+            'Accept-Language': 'ru-RU,ru;q=0.8,en-US;q=0.5,en;q=0.3',
+            'Accept-Encoding': 'gzip, br, deflate',
+        },
+        timeout=httpx.Timeout(DEFAULT_TIMEOUT, read=30.0),
+        follow_redirects=True
+    )
+
+
+# Общий клиент для повторного использования соединений между запросами
+_CLIENT = _create_client()
+
+# Резюме, которые создаются прямо сейчас (URL -> результат первого запроса)
+_inflight: Dict[str, Future] = {}
+_inflight_lock = threading.Lock()
+
+
+def _fetch_response(url: str, headers: Optional[Dict[str, str]] = None) -> httpx.Response:
+    """
+    Выполняет GET-запрос к странице через общий клиент.
     
     Args:
         url: URL страницы для загрузки
+        headers: Дополнительные заголовки (например, условные If-None-Match)
         
     Returns:
-        HTML-контент в виде строки или None в случае ошибки
+        Ответ сервера (в том числе 304 Not Modified для условных запросов).
+        Тело не загружается заранее: его нужно прочитать через iter_bytes
+        или закрыть ответ.
         
     Raises:
-        requests.exceptions.RequestException: При ошибках сети
+        httpx.HTTPError: При ошибках сети или HTTP-статусе ошибки
         ValueError: При невалидном URL
     """
     try:
@@ -49,30 +115,26 @@ def fetch_url_content(url: str) -> Optional[str]:
         
         logger.info(f"Загружаю контент с URL: {url}")
         
-        headers = {
-            'User-Agent': USER_AGENT,
-            'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8',
-            'Accept-Language': 'ru-RU,ru;q=0.8,en-US;q=0.5,en;q=0.3',
-            'Accept-Encoding': 'gzip, deflate',
-            'Connection': 'keep-alive',
-        }
-        
-        response = requests.get(
-            url, 
-            headers=headers, 
-            timeout=DEFAULT_TIMEOUT,
-            allow_redirects=True
-        )
-        response.raise_for_status()
+        request = _CLIENT.build_request('GET', url, headers=headers)
+        response = _CLIENT.send(request, stream=True)
+        
+        # httpx считает ошибкой любой не-2xx статус, но 304 - ожидаемый ответ
+        # на условный запрос
+        if response.status_code != 304:
+            try:
+                response.raise_for_status()
+            except httpx.HTTPStatusError:
+                response.close()
+                raise
         
         # Проверяем, что получили HTML
         content_type = response.headers.get('content-type', '').lower()
-        if 'text/html' not in content_type:
+        if response.status_code != 304 and 'text/html' not in content_type:
             logger.warning(f"Получен не HTML контент: {content_type}")
             
-        return response.text
+        return response
         
-    except requests.exceptions.RequestException as e:
+    except httpx.HTTPError as e:
         logger.error(f"Ошибка при загрузке URL {url}: {e}")
         raise
     except ValueError as e:
@@ -83,54 +145,267 @@ def fetch_url_content(url: str) -> Optional[str]:
         raise
 
 
-def clean_html(html: str) -> str:
+def fetch_url_content(url: str) -> Optional[bytes]:
     """
-    Извлекает чистый текст из HTML, удаляя теги, скрипты и стили.
+    Загружает HTML-контент с указанного URL.
+    
+    Контент возвращается без декодирования: кодировку определяет парсер
+    (по заголовку Content-Type, BOM или <meta charset>).
     
     Args:
-        html: HTML-контент в виде строки
+        url: URL страницы для загрузки
         
     Returns:
-        Очищенный текст без HTML-тегов
+        HTML-контент в виде байтов или None в случае ошибки
+        
+    Raises:
+        httpx.HTTPError: При ошибках сети
+        ValueError: При невалидном URL
+    """
+    response = _fetch_response(url)
+    try:
+        return response.read()
+    finally:
+        response.close()
+
+
+def _declared_charset(response: httpx.Response) -> Optional[str]:
+    """
+    Возвращает кодировку, явно указанную в заголовке Content-Type.
+    
+    Если заголовок не указывает кодировку, возвращает None,
+    чтобы парсер сам определил ее по <meta charset>.
     """
+    charset = response.charset_encoding
+    if charset is None:
+        return None
     try:
-        soup = BeautifulSoup(html, 'html.parser')
+        codecs.lookup(charset)
+        return charset
+    except LookupError:
+        logger.warning(f"Неизвестная кодировка в заголовке: {charset}")
+        return None
+
+
+def _collapse_whitespace(text: str) -> str:
+    """
+    Схлопывает любые последовательности пробельных символов в один пробел.
+    
+    str.split() без аргументов делает это за один проход на C и заметно
+    быстрее, чем re.sub(r'\s+', ' ', text).
+    """
+    return ' '.join(text.split())
+
+
+def _extract_text_selectolax(html: Union[str, bytes]) -> str:
+    """
+    Извлекает видимый текст из HTML с помощью selectolax (lexbor).
+    
+    Args:
+        html: HTML-контент; для байтов lexbor сам определяет кодировку
+            по BOM и <meta charset> (по умолчанию UTF-8)
+        
+    Returns:
+        Текст страницы без скриптов, стилей и навигации (пробелы не схлопнуты)
+    """
+    tree = LexborHTMLParser(html, encoding=True)
+    
+    # Удаляем скрипты, стили и служебные блоки за один обход дерева
+    for node in tree.css(_STRIP_SELECTOR):
+        node.decompose()
+    
+    root = tree.body if tree.body is not None else tree.root
+    if root is None:
+        return ""
+    
+    return root.text(separator=' ')
+
+
+class _TextCollector:
+    """
+    Цель для потокового парсера lxml: собирает текст вне служебных тегов.
+    
+    Текст внутри CONTENT_TAGS собирается отдельно; если на странице
+    таких тегов нет (верстка на одних div), возвращается весь видимый текст.
+    """
+    
+    def __init__(self):
+        self._parts: List[str] = []
+        self._content_parts: List[str] = []
+        self._skip_depth = 0
+        self._content_depth = 0
+    
+    def start(self, tag, attrib):
+        if self._skip_depth or tag in STRIP_TAGS:
+            self._skip_depth += 1
+        if self._content_depth or tag in CONTENT_TAGS:
+            self._content_depth += 1
+    
+    def end(self, tag):
+        if self._skip_depth:
+            self._skip_depth -= 1
+        if self._content_depth:
+            self._content_depth -= 1
+    
+    def data(self, data):
+        if self._skip_depth:
+            return
+        self._parts.append(data)
+        if self._content_depth:
+            self._content_parts.append(data)
+    
+    def close(self) -> str:
+        content = ' '.join(self._content_parts)
+        if content.strip():
+            return content
+        return ' '.join(self._parts)
+
+
+def _has_charset_hint(head: bytes) -> bool:
+    """Проверяет, есть ли в начале документа BOM или объявление charset."""
+    if head.startswith((codecs.BOM_UTF8, codecs.BOM_UTF16_LE, codecs.BOM_UTF16_BE)):
+        return True
+    # Стандарт HTML ищет <meta charset> в первых 1024 байтах
+    return b'charset' in head[:1024].lower()
+
+
+def _extract_text_lxml(chunks: Iterable[bytes], encoding: Optional[str] = None) -> str:
+    """
+    Извлекает видимый текст из HTML потоковым парсером lxml.
+    
+    Дерево документа не строится: блоки подаются в парсер по мере
+    загрузки, а текст собирается на лету только из тегов с основным
+    содержимым (CONTENT_TAGS).
+    
+    Args:
+        chunks: Блоки HTML-контента
+        encoding: Кодировка из заголовков ответа; если не указана,
+            libxml2 определяет ее по BOM и <meta charset>, а при их
+            отсутствии используется UTF-8
         
-        # Удаляем скрипты и стили
-        for script in soup(["script", "style", "nav", "footer", "header"]):
-            script.decompose()
+    Returns:
+        Текст страницы без скриптов, стилей и навигации (пробелы не схлопнуты)
+    """
+    chunks = iter(chunks)
+    if encoding is None:
+        # Без объявления кодировки libxml2 читает документ как ISO-8859-1,
+        # поэтому по началу документа проверяем, есть ли BOM или <meta charset>
+        first = next(chunks, b'')
+        if isinstance(first, bytes) and not _has_charset_hint(first):
+            encoding = 'utf-8'
+        chunks = itertools.chain([first], chunks)
+    
+    collector = _TextCollector()
+    parser = etree.HTMLParser(target=collector, encoding=encoding, recover=True)
+    for chunk in chunks:
+        if chunk:
+            parser.feed(chunk)
+    
+    try:
+        text = parser.close()
+    except etree.XMLSyntaxError:
+        # Пустой документ: libxml2 не нашел ни одного элемента
+        text = collector.close()
+    return text
+
+
+def clean_html(html: Union[str, bytes, Iterable[bytes]], encoding: Optional[str] = None) -> str:
+    """
+    Извлекает чистый текст из HTML, удаляя теги, скрипты и стили.
+    
+    По умолчанию используется selectolax; при HTML_PARSER=lxml или
+    отсутствии selectolax - потоковый парсер lxml.
+    
+    Args:
+        html: HTML-контент в виде строки, байтов или итератора блоков байтов
+            (например, response.iter_bytes())
+        encoding: Кодировка байтового контента, если известна
         
-        # Получаем текст
-        text = soup.get_text()
+    Returns:
+        Очищенный текст без HTML-тегов
+    """
+    try:
+        if HTML_PARSER == "selectolax" and LexborHTMLParser is not None:
+            if not isinstance(html, (str, bytes)):
+                html = b''.join(html)
+            # Кодировка из заголовков имеет приоритет над <meta charset>
+            if isinstance(html, bytes) and encoding:
+                html = html.decode(encoding, errors='replace')
+            text = _extract_text_selectolax(html)
+        else:
+            if isinstance(html, (str, bytes)):
+                html = [html]
+            text = _extract_text_lxml(html, encoding)
         
         # Очищаем от лишних пробелов и переносов строк
-        lines = (line.strip() for line in text.splitlines())
-        chunks = (phrase.strip() for line in lines for phrase in line.split("  "))
-        text = ' '.join(chunk for chunk in chunks if chunk)
-        
-        return text
+        return _collapse_whitespace(text)
         
     except Exception as e:
         logger.error(f"Ошибка при очистке HTML: {e}")
         raise
 
 
-def truncate_text(text: str, max_length: int = MAX_TEXT_LENGTH) -> str:
+# Токенизатор загружается при первом обращении; неудачная загрузка
+# (например, нет доступа к файлу кодировки) повторяется не чаще раза в минуту
+ENCODING_RETRY_INTERVAL = 60  # секунды
+_encoding = None
+_encoding_retry_at = 0.0
+_encoding_lock = threading.Lock()
+
+
+def _get_encoding():
     """
-    Обрезает текст до указанной длины, сохраняя целостность предложений.
+    Возвращает токенизатор модели (создается один раз на процесс).
+    
+    Кэшируется только успешно загруженный токенизатор, поэтому временная
+    ошибка загрузки не отключает подсчет токенов до перезапуска.
+    
+    Returns:
+        Кодировка tiktoken или None, если tiktoken недоступен
+    """
+    global _encoding, _encoding_retry_at
+    if _encoding is not None or tiktoken is None:
+        return _encoding
+    
+    with _encoding_lock:
+        if _encoding is None and time.monotonic() >= _encoding_retry_at:
+            try:
+                _encoding = tiktoken.encoding_for_model(TOKENIZER_MODEL)
+            except Exception as e:
+                _encoding_retry_at = time.monotonic() + ENCODING_RETRY_INTERVAL
+                logger.warning(f"Не удалось загрузить токенизатор {TOKENIZER_MODEL}: {e}")
+    return _encoding
+
+
+def truncate_text(text: str, max_tokens: int = MAX_PROMPT_TOKENS) -> str:
+    """
+    Обрезает текст до указанного числа токенов, сохраняя целостность предложений.
+    
+    Если токенизатор недоступен, текст обрезается до MAX_TEXT_LENGTH символов.
     
     Args:
         text: Исходный текст
-        max_length: Максимальная длина текста
+        max_tokens: Максимальная длина текста в токенах
         
     Returns:
         Обрезанный текст
     """
-    if len(text) <= max_length:
+    # Байтовый BPE дает не больше токенов, чем байт в UTF-8, а символ
+    # занимает не больше 4 байт - такой короткий текст точно влезает
+    if len(text) * 4 <= max_tokens:
         return text
     
-    # Обрезаем до max_length символов
-    truncated = text[:max_length]
+    encoding = _get_encoding()
+    if encoding is None:
+        if len(text) <= MAX_TEXT_LENGTH:
+            return text
+        truncated = text[:MAX_TEXT_LENGTH]
+    else:
+        tokens = encoding.encode(text, disallowed_special=())
+        if len(tokens) <= max_tokens:
+            return text
+        # Срез по токенам может разрезать многобайтовый символ
+        truncated = encoding.decode(tokens[:max_tokens]).rstrip('\ufffd')
     
     # Ищем последнее полное предложение
     last_sentence_end = max(
@@ -139,7 +414,7 @@ def truncate_text(text: str, max_length: int = MAX_TEXT_LENGTH) -> str:
         truncated.rfind('?')
     )
     
-    if last_sentence_end > max_length * 0.8:  # Если нашли предложение в последних 20%
+    if last_sentence_end > len(truncated) * 0.8:  # Если нашли предложение в последних 20%
         return truncated[:last_sentence_end + 1]
     
     return truncated
@@ -149,6 +424,9 @@ def summarize_url(url: str) -> str:
     """
     Создает краткое резюме веб-страницы по URL.
     
+    Одновременные запросы одного и того же URL объединяются: страницу
+    загружает и резюмирует только первый, остальные ждут его результат.
+    
     Args:
         url: URL страницы для анализа
         
@@ -156,25 +434,89 @@ def summarize_url(url: str) -> str:
         Краткое резюме страницы (3-5 предложений)
         
     Raises:
-        requests.exceptions.RequestException: При ошибках загрузки
+        httpx.HTTPError: При ошибках загрузки
         ValueError: При невалидном URL или пустом контенте
         Exception: При других ошибках обработки
     """
+    with _inflight_lock:
+        future = _inflight.get(url)
+        is_leader = future is None
+        if is_leader:
+            future = Future()
+            _inflight[url] = future
+    
+    if not is_leader:
+        logger.info(f"Резюме для {url} уже создается, ожидаю результат")
+        return future.result()
+    
+    try:
+        summary = _summarize_url(url)
+        future.set_result(summary)
+        return summary
+    except BaseException as e:
+        future.set_exception(e)
+        raise
+    finally:
+        with _inflight_lock:
+            _inflight.pop(url, None)
+
+
+def _summarize_url(url: str) -> str:
+    """
+    Загружает страницу и создает резюме без объединения запросов.
+    
+    Args:
+        url: URL страницы для анализа
+        
+    Returns:
+        Краткое резюме страницы (3-5 предложений)
+    """
     try:
-        # Загружаем HTML-контент
-        html_content = fetch_url_content(url)
-        if not html_content:
-            raise ValueError("Не удалось загрузить контент с указанного URL")
+        # Условный запрос по сохраненным ETag/Last-Modified
+        cached = summary_cache.get(url)
+        headers = {}
+        if cached:
+            if cached['etag']:
+                headers['If-None-Match'] = cached['etag']
+            if cached['last_modified']:
+                headers['If-Modified-Since'] = cached['last_modified']
+        
+        # Загружаем HTML-контент и разбираем его по мере поступления
+        response = _fetch_response(url, headers)
+        try:
+            if response.status_code == 304 and cached:
+                logger.info(f"Страница не изменилась (304), резюме взято из кэша: {url}")
+                return cached['summary']
+            
+            clean_text = clean_html(
+                response.iter_bytes(chunk_size=CHUNK_SIZE),
+                encoding=_declared_charset(response)
+            )
+        finally:
+            response.close()
         
-        # Очищаем HTML
-        clean_text = clean_html(html_content)
         if not clean_text.strip():
             raise ValueError("Не удалось извлечь текстовый контент из HTML")
         
+        # Тот же текст уже резюмировался - повторный вызов LLM не нужен
+        etag = response.headers.get('ETag')
+        last_modified = response.headers.get('Last-Modified')
+        # Хеш нужен только для сравнения текстов, криптостойкость не требуется
+        content_hash = hashlib.blake2b(clean_text.encode('utf-8'), digest_size=16).digest()
+        if cached and cached['content_hash'] == content_hash:
+            summary = cached['summary']
+        else:
+            summary = summary_cache.find_by_hash(content_hash)
+        if summary:
+            logger.info(f"Содержимое не изменилось, резюме взято из кэша: {url}")
+            summary_cache.put(url, summary, content_hash, etag, last_modified)
+            return summary
+        
         # Обрезаем текст если он слишком длинный
-        if len(clean_text) > MAX_TEXT_LENGTH:
-            logger.info(f"Текст слишком длинный ({len(clean_text)} символов), обрезаю до {MAX_TEXT_LENGTH}")
-            clean_text = truncate_text(clean_text)
+        truncated_text = truncate_text(clean_text)
+        if len(truncated_text) < len(clean_text):
+            logger.info(f"Текст слишком длинный ({len(clean_text)} символов), обрезан до {len(truncated_text)}")
+            clean_text = truncated_text
         
         logger.info(f"Подготавливаю резюме для текста длиной {len(clean_text)} символов")
         
@@ -191,9 +533,10 @@ def summarize_url(url: str) -> str:
                 logger.error(f"Ошибка Ollama API: {ollama_error}")
                 raise Exception(f"Не удалось создать резюме ни через OpenAI, ни через Ollama. OpenAI ошибка: {e}, Ollama ошибка: {ollama_error}")
         
+        summary_cache.put(url, summary, content_hash, etag, last_modified)
         return summary
         
-    except (requests.exceptions.RequestException, ValueError) as e:
+    except (httpx.HTTPError, ValueError) as e:
         logger.error(f"Ошибка при обработке URL {url}: {e}")
         raise
     except Exception as e:
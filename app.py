@@ -5,16 +5,30 @@ Flask веб-приложение для агента page_summarizer.
 с историей запросов и логированием через Logtail.
 """
 
+import os
+import orjson
+from threading import BoundedSemaphore
 from flask import Flask, render_template, request, jsonify
 from agent import summarize_url
 from history import history_manager
-from logger_config import get_logger
+from logger_config import setup_logging, get_logger
 
-# Настройка логирования
+# Настройка логирования (один раз на процесс)
+setup_logging()
 logger = get_logger(__name__)
 
 app = Flask(__name__)
 
+# Сколько запросов /summarize обрабатывается одновременно. Значение должно быть
+# меньше числа потоков gunicorn (--threads), чтобы свободные потоки оставались
+# для /history, /stats и /health; лишние запросы сразу получают 503
+SUMMARIZE_WORKERS = int(os.getenv("SUMMARIZE_WORKERS", "8"))
+summarize_slots = BoundedSemaphore(SUMMARIZE_WORKERS)
+
+def orjson_response(payload, status: int = 200):
+    """Формирует JSON-ответ, сериализованный через orjson."""
+    return app.response_class(orjson.dumps(payload), status=status, mimetype='application/json')
+
 @app.route('/')
 def index():
     """Главная страница с формой ввода URL."""
@@ -35,8 +49,18 @@ def summarize():
         
         logger.info(f"Получен запрос на создание резюме для: {url}")
         
+        if not summarize_slots.acquire(blocking=False):
+            logger.warning(f"Все слоты заняты, запрос отклонен: {url}")
+            return jsonify({
+                'success': False,
+                'error': 'Сервер перегружен, повторите запрос позже'
+            }), 503
+        
         # Создаем резюме
-        summary = summarize_url(url)
+        try:
+            summary = summarize_url(url)
+        finally:
+            summarize_slots.release()
         
         # Добавляем в историю
         history_record = history_manager.add_request(url, summary, success=True)
@@ -69,7 +93,7 @@ def get_history():
     try:
         limit = request.args.get('limit', type=int)
         history = history_manager.get_history(limit)
-        return jsonify({
+        return orjson_response({
             'success': True,
             'history': history
         })
@@ -147,7 +171,7 @@ def get_stats():
     """Получает статистику по истории."""
     try:
         stats = history_manager.get_stats()
-        return jsonify({
+        return orjson_response({
             'success': True,
             'stats': stats
         })
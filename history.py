@@ -1,21 +1,44 @@
 """
 Модуль для управления историей запросов.
 
-Сохраняет историю запросов локально в JSON файле
-и предоставляет функции для работы с ней.
+Сохраняет историю запросов локально в JSON Lines файле
+и предоставляет функции для работы с ней. История держится в памяти,
+новые записи дописываются в конец файла, а полная перезапись
+(компактизация) выполняется только при удалении и очистке.
 """
 
-import json
 import os
+import re
+import threading
+from collections import deque
+from itertools import islice
 from datetime import datetime
-from typing import List, Dict, Optional
+from typing import Deque, List, Sequence, Dict, Optional
 import logging
+import orjson
 
 logger = logging.getLogger(__name__)
 
 # Константы
-HISTORY_FILE = "request_history.json"
+HISTORY_FILE = "request_history.jsonl"
+LEGACY_HISTORY_FILE = "request_history.json"  # Прежний формат: один JSON-массив
 MAX_HISTORY_SIZE = 100  # Максимальное количество записей в истории
+COMPACT_THRESHOLD = MAX_HISTORY_SIZE * 2  # Число строк в файле, после которого он сжимается
+
+_SENTENCE_END_RE = re.compile(r'[.!?…]+')
+
+
+def _count_sentences(text: str) -> int:
+    """Считает предложения по знакам конца предложения, не разбивая текст на части."""
+    count = 0
+    end = 0
+    for match in _SENTENCE_END_RE.finditer(text):
+        count += 1
+        end = match.end()
+    # Хвост без завершающего знака тоже предложение
+    if text[end:].strip():
+        count += 1
+    return count
 
 
 class HistoryManager:
@@ -23,133 +46,186 @@ class HistoryManager:
     
     def __init__(self, history_file: str = HISTORY_FILE):
         self.history_file = history_file
+        self._lock = threading.RLock()
         self._ensure_history_file()
+        records = self._load_history()
+        self._file_records = len(records)
+        # Новые записи добавляются слева, старые вытесняются справа за O(1)
+        self._history: Deque[Dict] = deque(records[:MAX_HISTORY_SIZE])
+        self._by_id: Dict[int, Dict] = {record['id']: record for record in self._history}
+        self._next_id = max(self._by_id, default=0) + 1
+        
+        # Агрегаты для get_stats, обновляются при каждом изменении истории
+        self._successful = 0
+        self._failed = 0
+        self._total_chars = 0
+        self._total_sentences = 0
+        for record in self._history:
+            self._account(record, 1)
+    
+    def _account(self, record: Dict, sign: int):
+        """Учитывает запись в агрегатах статистики (sign=1) или исключает ее (sign=-1)."""
+        if record['success']:
+            self._successful += sign
+            self._total_chars += sign * record.get('char_count', 0)
+            self._total_sentences += sign * record.get('sentence_count', 0)
+        else:
+            self._failed += sign
     
     def _ensure_history_file(self):
         """Создает файл истории, если он не существует."""
-        if not os.path.exists(self.history_file):
-            self._save_history([])
-            logger.info(f"Создан новый файл истории: {self.history_file}")
+        if os.path.exists(self.history_file):
+            return
+        
+        legacy_file = os.path.join(os.path.dirname(self.history_file), LEGACY_HISTORY_FILE)
+        if os.path.exists(legacy_file):
+            try:
+                with open(legacy_file, 'rb') as f:
+                    legacy = orjson.loads(f.read())
+                self._save_history(legacy if isinstance(legacy, list) else [])
+                logger.info(f"История перенесена из {legacy_file} в {self.history_file}")
+                return
+            except (OSError, orjson.JSONDecodeError) as e:
+                logger.warning(f"Не удалось перенести историю из {legacy_file}: {e}")
+        
+        self._save_history([])
+        logger.info(f"Создан новый файл истории: {self.history_file}")
     
     def _load_history(self) -> List[Dict]:
-        """Загружает историю из файла."""
+        """Загружает историю из файла (новые записи первыми)."""
+        history = []
         try:
-            with open(self.history_file, 'r', encoding='utf-8') as f:
-                history = json.load(f)
-                return history if isinstance(history, list) else []
-        except (FileNotFoundError, json.JSONDecodeError) as e:
+            with open(self.history_file, 'rb') as f:
+                for line in f:
+                    line = line.strip()
+                    if not line:
+                        continue
+                    try:
+                        history.append(orjson.loads(line))
+                    except orjson.JSONDecodeError as e:
+                        # Например, недописанная строка после сбоя
+                        logger.warning(f"Пропущена поврежденная запись истории: {e}")
+        except FileNotFoundError as e:
             logger.warning(f"Ошибка загрузки истории: {e}")
             return []
+        
+        # В файле записи идут от старых к новым
+        history.reverse()
+        return history
+    
+    def _append_record(self, record: Dict):
+        """Дописывает одну запись в конец файла истории."""
+        try:
+            with open(self.history_file, 'ab') as f:
+                f.write(orjson.dumps(record) + b'\n')
+            self._file_records += 1
+        except Exception as e:
+            logger.error(f"Ошибка сохранения истории: {e}")
     
-    def _save_history(self, history: List[Dict]):
-        """Сохраняет историю в файл."""
+    def _save_history(self, history: Sequence[Dict]):
+        """Атомарно перезаписывает файл истории через временный файл."""
+        tmp_file = self.history_file + '.tmp'
         try:
-            with open(self.history_file, 'w', encoding='utf-8') as f:
-                json.dump(history, f, ensure_ascii=False, indent=2)
+            with open(tmp_file, 'wb') as f:
+                f.write(b''.join(orjson.dumps(record) + b'\n' for record in reversed(history)))
+            os.replace(tmp_file, self.history_file)
+            self._file_records = len(history)
         except Exception as e:
             logger.error(f"Ошибка сохранения истории: {e}")
     
     def add_request(self, url: str, summary: str, success: bool = True, error: Optional[str] = None) -> Dict:
         """Добавляет новый запрос в историю."""
-        history = self._load_history()
-        
-        # Создаем новую запись
-        record = {
-            'id': len(history) + 1,
-            'url': url,
-            'summary': summary if success else None,
-            'success': success,
-            'error': error,
-            'timestamp': datetime.now().isoformat(),
-            'char_count': len(summary) if success and summary else 0,
-            'sentence_count': len(summary.split('.')) if success and summary else 0
-        }
-        
-        # Добавляем в начало списка
-        history.insert(0, record)
-        
-        # Ограничиваем размер истории
-        if len(history) > MAX_HISTORY_SIZE:
-            history = history[:MAX_HISTORY_SIZE]
-        
-        # Обновляем ID
-        for i, record in enumerate(history):
-            record['id'] = i + 1
+        with self._lock:
+            history = self._history
+            
+            # Создаем новую запись
+            record = {
+                'id': self._next_id,
+                'url': url,
+                'summary': summary if success else None,
+                'success': success,
+                'error': error,
+                'timestamp': datetime.now().isoformat(),
+                'char_count': len(summary) if success and summary else 0,
+                'sentence_count': _count_sentences(summary) if success and summary else 0
+            }
+            
+            self._next_id += 1
+            
+            # Ограничиваем размер истории
+            while len(history) >= MAX_HISTORY_SIZE:
+                evicted = history.pop()
+                self._by_id.pop(evicted['id'], None)
+                self._account(evicted, -1)
+            
+            # Добавляем в начало очереди
+            history.appendleft(record)
+            self._by_id[record['id']] = record
+            self._account(record, 1)
+            
+            # Вытесненные записи остаются в файле до компактизации
+            if self._file_records >= COMPACT_THRESHOLD:
+                self._save_history(history)
+            else:
+                self._append_record(record)
         
-        self._save_history(history)
         logger.info(f"Добавлен запрос в историю: {url}")
         
         return record
     
     def get_history(self, limit: Optional[int] = None) -> List[Dict]:
         """Получает историю запросов."""
-        history = self._load_history()
-        if limit:
-            history = history[:limit]
-        return history
+        with self._lock:
+            if limit:
+                return list(islice(self._history, limit))
+            return list(self._history)
     
     def get_request_by_id(self, request_id: int) -> Optional[Dict]:
         """Получает запрос по ID."""
-        history = self._load_history()
-        for record in history:
-            if record['id'] == request_id:
-                return record
-        return None
+        with self._lock:
+            return self._by_id.get(request_id)
     
     def clear_history(self):
         """Очищает всю историю."""
-        self._save_history([])
+        with self._lock:
+            self._history.clear()
+            self._by_id.clear()
+            self._successful = self._failed = 0
+            self._total_chars = self._total_sentences = 0
+            self._save_history(self._history)
         logger.info("История запросов очищена")
     
     def delete_request(self, request_id: int) -> bool:
         """Удаляет запрос по ID."""
-        history = self._load_history()
-        original_length = len(history)
-        
-        history = [record for record in history if record['id'] != request_id]
-        
-        if len(history) < original_length:
-            # Обновляем ID
-            for i, record in enumerate(history):
-                record['id'] = i + 1
+        with self._lock:
+            record = self._by_id.pop(request_id, None)
+            if record is None:
+                return False
             
-            self._save_history(history)
-            logger.info(f"Удален запрос из истории: ID {request_id}")
-            return True
+            self._history.remove(record)
+            self._account(record, -1)
+            self._save_history(self._history)
         
-        return False
+        logger.info(f"Удален запрос из истории: ID {request_id}")
+        return True
     
     def get_stats(self) -> Dict:
         """Получает статистику по истории."""
-        history = self._load_history()
-        
-        if not history:
+        with self._lock:
+            successful = self._successful
+            total_chars = self._total_chars
+            total_sentences = self._total_sentences
+            
             return {
-                'total_requests': 0,
-                'successful_requests': 0,
-                'failed_requests': 0,
-                'total_characters': 0,
-                'average_characters': 0,
-                'total_sentences': 0,
-                'average_sentences': 0
+                'total_requests': successful + self._failed,
+                'successful_requests': successful,
+                'failed_requests': self._failed,
+                'total_characters': total_chars,
+                'average_characters': total_chars // successful if successful else 0,
+                'total_sentences': total_sentences,
+                'average_sentences': total_sentences // successful if successful else 0
             }
-        
-        successful = [r for r in history if r['success']]
-        failed = [r for r in history if not r['success']]
-        
-        total_chars = sum(r.get('char_count', 0) for r in successful)
-        total_sentences = sum(r.get('sentence_count', 0) for r in successful)
-        
-        return {
-            'total_requests': len(history),
-            'successful_requests': len(successful),
-            'failed_requests': len(failed),
-            'total_characters': total_chars,
-            'average_characters': total_chars // len(successful) if successful else 0,
-            'total_sentences': total_sentences,
-            'average_sentences': total_sentences // len(successful) if successful else 0
-        }
 
 
 # Глобальный экземпляр менеджера истории
-history_manager = HistoryManager() 
\ No newline at end of file
+history_manager = HistoryManager()
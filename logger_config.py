@@ -2,11 +2,16 @@
 Модуль для настройки логирования с интеграцией Logtail.
 
 Настраивает логирование для приложения с поддержкой
-локального логирования и отправки в Logtail.
+локального логирования и отправки в Logtail. Запись в консоль,
+файл и Logtail выполняется в фоновом потоке через очередь,
+чтобы не блокировать потоки обработки запросов.
 """
 
 import os
+import queue
+import atexit
 import logging
+import logging.handlers
 from dotenv import load_dotenv
 
 # Загружаем переменные окружения
@@ -15,9 +20,21 @@ load_dotenv()
 # Получение токена Logtail
 LOGTAIL_TOKEN = os.getenv('LOGTAIL_TOKEN')
 
+# Настройки файла логов
+LOG_FILE = 'app.log'
+LOG_MAX_BYTES = 10 * 1024 * 1024  # 10 МБ
+LOG_BACKUP_COUNT = 5
+
 
 def setup_logging():
-    """Настраивает логирование с интеграцией Logtail."""
+    """
+    Настраивает логирование с интеграцией Logtail.
+    
+    Выполняется один раз на процесс: повторные вызовы возвращают
+    уже настроенный корневой логгер, не создавая хендлеры заново.
+    """
+    if getattr(setup_logging, "_done", False):
+        return logging.getLogger()
     
     # Создаем форматтер
     formatter = logging.Formatter(
@@ -36,44 +53,56 @@ def setup_logging():
     console_handler = logging.StreamHandler()
     console_handler.setFormatter(formatter)
     console_handler.setLevel(logging.INFO)
-    root_logger.addHandler(console_handler)
+    handlers = [console_handler]
     
-    # Хендлер для файла
-    file_handler = logging.FileHandler('app.log', encoding='utf-8')
+    # Хендлер для файла с ротацией
+    file_handler = logging.handlers.RotatingFileHandler(
+        LOG_FILE, maxBytes=LOG_MAX_BYTES, backupCount=LOG_BACKUP_COUNT, encoding='utf-8'
+    )
     file_handler.setFormatter(formatter)
     file_handler.setLevel(logging.INFO)
-    root_logger.addHandler(file_handler)
+    handlers.append(file_handler)
     
     # Хендлер для Logtail (если токен указан)
+    # Сообщения о подключении пишем после запуска очереди
+    status_messages = []
     if LOGTAIL_TOKEN:
         try:
             from logtail import LogtailHandler
             logtail_handler = LogtailHandler(LOGTAIL_TOKEN)
             logtail_handler.setFormatter(formatter)
             logtail_handler.setLevel(logging.INFO)
-            root_logger.addHandler(logtail_handler)
+            handlers.append(logtail_handler)
             
-            root_logger.info('Logtail интеграция активирована')
+            status_messages.append((logging.INFO, 'Logtail интеграция активирована'))
             print("✅ Logtail подключен успешно!")
             
         except ImportError:
-            root_logger.warning('Модуль logtail-python не установлен')
+            status_messages.append((logging.WARNING, 'Модуль logtail-python не установлен'))
             print("⚠️ Установите logtail-python: pip install logtail-python")
             
         except Exception as e:
-            root_logger.warning(f'Не удалось подключить Logtail: {e}')
+            status_messages.append((logging.WARNING, f'Не удалось подключить Logtail: {e}'))
             print(f"❌ Ошибка подключения к Logtail: {e}")
     else:
-        root_logger.info('LOGTAIL_TOKEN не указан, внешнее логирование отключено')
+        status_messages.append((logging.INFO, 'LOGTAIL_TOKEN не указан, внешнее логирование отключено'))
         print("ℹ️ LOGTAIL_TOKEN не найден, логирование только локальное")
     
+    # Потоки запросов только кладут записи в очередь,
+    # а форматирование и запись выполняет фоновый поток
+    log_queue = queue.SimpleQueue()
+    root_logger.addHandler(logging.handlers.QueueHandler(log_queue))
+    listener = logging.handlers.QueueListener(log_queue, *handlers, respect_handler_level=True)
+    listener.start()
+    atexit.register(listener.stop)
+    
+    for level, message in status_messages:
+        root_logger.log(level, message)
+    
+    setup_logging._done = True
     return root_logger
 
 
 def get_logger(name: str) -> logging.Logger:
     """Получает логгер с указанным именем."""
     return logging.getLogger(name)
-
-
-# Инициализируем логирование при импорте модуля
-setup_logging()
\ No newline at end of file
@@ -7,25 +7,60 @@
 """
 
 import os
-import time
 import logging
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 from typing import Optional
 from dotenv import load_dotenv
 
 # Загружаем переменные окружения
 load_dotenv()
 
-# Настройка логирования
-logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 # Константы
 SYSTEM_PROMPT = "Ты аналитик. Сформулируй суть текста в 3–5 предложениях на русском языке. Даже если исходный текст на другом языке, всегда отвечай на русском."
 MODEL_NAME = os.getenv("OLLAMA_MODEL", "llama3.2")
 OLLAMA_BASE_URL = os.getenv("OLLAMA_BASE_URL", "http://localhost:11434")
+KEEP_ALIVE = os.getenv("OLLAMA_KEEP_ALIVE", "10m")  # Сколько держать модель в памяти между запросами
 MAX_RETRIES = int(os.getenv("MAX_RETRIES", "3"))
-BASE_DELAY = int(os.getenv("BASE_DELAY", "1"))  # секунды
+BASE_DELAY = float(os.getenv("BASE_DELAY", "1"))  # секунды
+MAX_BACKOFF = int(os.getenv("MAX_BACKOFF", "60"))  # Верхняя граница задержки между попытками, секунды
+
+
+def _create_session() -> requests.Session:
+    """
+    Создает сессию для Ollama с keep-alive и повторными попытками.
+    
+    Повторы с экспоненциальной задержкой (с учетом Retry-After) выполняет
+    urllib3 на уровне адаптера. Случайная добавка к задержке разводит
+    повторы параллельных потоков во времени. Ошибки соединения не повторяются:
+    если Ollama не запущен, повторные попытки не помогут.
+    
+    Returns:
+        Настроенная сессия requests
+    """
+    retry = Retry(
+        total=MAX_RETRIES,
+        connect=0,
+        backoff_factor=BASE_DELAY,
+        backoff_jitter=BASE_DELAY,
+        backoff_max=MAX_BACKOFF,
+        status_forcelist=[429, 500, 502, 503, 504],
+        allowed_methods=frozenset(["GET", "POST"]),
+        respect_retry_after_header=True
+    )
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=10, max_retries=retry)
+    
+    session = requests.Session()
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+# Общая сессия для keep-alive соединений с Ollama
+_OLLAMA_SESSION = _create_session()
 
 
 def _get_ollama_url() -> str:
@@ -42,22 +77,6 @@ def _get_ollama_url() -> str:
     return f"{base_url}/api/generate"
 
 
-def _check_ollama_available() -> bool:
-    """
-    Проверяет доступность Ollama сервиса.
-    
-    Returns:
-        True если Ollama доступен, False в противном случае
-    """
-    try:
-        url = _get_ollama_url()
-        response = requests.get(url.replace("/api/generate", "/api/tags"), timeout=5)
-        return response.status_code == 200
-    except Exception as e:
-        logger.warning(f"Ollama недоступен: {e}")
-        return False
-
-
 def summarize_text(text: str) -> str:
     """
     Создает краткое резюме текста с помощью Ollama API.
@@ -71,51 +90,37 @@ def summarize_text(text: str) -> str:
     Raises:
         Exception: При ошибках API или недоступности сервиса
     """
-    if not _check_ollama_available():
+    url = _get_ollama_url()
+    
+    # Системный промпт передается отдельным полем, Ollama сама подставит его в шаблон модели
+    payload = {
+        "model": MODEL_NAME,
+        "system": SYSTEM_PROMPT,
+        "prompt": text,
+        "stream": False,
+        "keep_alive": KEEP_ALIVE,
+        "options": {
+            "temperature": 0.3,
+            "num_predict": 500
+        }
+    }
+    
+    logger.info("Создание резюме через Ollama")
+    
+    try:
+        response = _OLLAMA_SESSION.post(url, json=payload, timeout=30)
+        response.raise_for_status()
+    
+    except requests.exceptions.ConnectionError as e:
+        logger.warning("Ollama недоступен: %s", e)
         raise Exception("Ollama сервис недоступен. Убедитесь, что Ollama запущен.")
     
-    url = _get_ollama_url()
+    except requests.exceptions.RequestException as e:
+        logger.error("Ошибка запроса к Ollama: %s", e)
+        raise Exception(f"Ошибка запроса к Ollama после {MAX_RETRIES} попыток: {e}")
     
-    prompt = f"{SYSTEM_PROMPT}\n\nТекст для анализа:\n{text}"
+    result = response.json()
+    if "response" not in result:
+        raise Exception("Неожиданный формат ответа от Ollama")
     
-    for attempt in range(MAX_RETRIES):
-        try:
-            logger.info(f"Попытка {attempt + 1}/{MAX_RETRIES} создания резюме через Ollama")
-            
-            payload = {
-                "model": MODEL_NAME,
-                "prompt": prompt,
-                "stream": False,
-                "options": {
-                    "temperature": 0.3,
-                    "num_predict": 500
-                }
-            }
-            
-            response = requests.post(url, json=payload, timeout=30)
-            response.raise_for_status()
-            
-            result = response.json()
-            if "response" in result:
-                return result["response"].strip()
-            else:
-                raise Exception("Неожиданный формат ответа от Ollama")
-                
-        except requests.exceptions.RequestException as e:
-            logger.error(f"Ошибка запроса к Ollama (попытка {attempt + 1}/{MAX_RETRIES}): {e}")
-            
-            if attempt < MAX_RETRIES - 1:
-                delay = BASE_DELAY * (2 ** attempt)
-                logger.info(f"Ожидание {delay} секунд перед повторной попыткой...")
-                time.sleep(delay)
-            else:
-                raise Exception(f"Ошибка запроса к Ollama после {MAX_RETRIES} попыток: {e}")
-                
-        except Exception as e:
-            logger.error(f"Неожиданная ошибка Ollama (попытка {attempt + 1}/{MAX_RETRIES}): {e}")
-            
-            if attempt == MAX_RETRIES - 1:
-                raise Exception(f"Неожиданная ошибка Ollama после {MAX_RETRIES} попыток: {e}")
-            
-            delay = BASE_DELAY * (2 ** attempt)
-            time.sleep(delay) 
\ No newline at end of file
+    return result["response"].strip()
@@ -4,170 +4,851 @@
 
 import os
 import time
-import hashlib
+import asyncio
 import logging
-from typing import Optional, Dict, Any
-from threading import Lock
-from openai import OpenAI
-from openai import RateLimitError, APIError
+import functools
+import re
+import random
+import queue
+import unicodedata
+import orjson
+from email.utils import parsedate_to_datetime
+from typing import Any, Dict, List, Optional, Tuple, Union
+from threading import Condition, Event, Lock, Thread, local
+from concurrent.futures import Future, ThreadPoolExecutor
+from cachetools import TTLCache
+from openai import OpenAI, AsyncOpenAI, DefaultHttpxClient, DefaultAsyncHttpxClient
+from openai import RateLimitError, APIError, APIConnectionError, APIStatusError, APITimeoutError
 from dotenv import load_dotenv
 
+try:
+    import diskcache
+except ImportError:
+    diskcache = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
 # Загружаем переменные окружения
 load_dotenv()
 
-# Настройка логирования
-logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 # Константы
 SYSTEM_PROMPT = "Ты аналитик. Сформулируй суть текста в 3–5 предложениях на русском языке. Даже если исходный текст на другом языке, всегда отвечай на русском."
+BATCH_SYSTEM_PROMPT = (
+    "Ты аналитик. Тебе передан JSON-объект с массивом текстов \"docs\". "
+    "Для каждого текста сформулируй суть в 3–5 предложениях на русском языке, "
+    "даже если текст на другом языке. Верни только JSON-объект вида "
+    "{\"summaries\": [...]} с резюме в том же порядке и того же количества."
+)
 MODEL_NAME = "gpt-4o"
 PROXY_BASE_URL = "https://api.proxyapi.ru/openai/v1"
 MAX_RETRIES = int(os.getenv("MAX_RETRIES", "3"))
-BASE_DELAY = int(os.getenv("BASE_DELAY", "2"))
+BASE_DELAY = float(os.getenv("BASE_DELAY", "2"))  # Начальная задержка между попытками, секунды
+MAX_BACKOFF = int(os.getenv("MAX_BACKOFF", "60"))  # Верхняя граница паузы после 429, секунды
+MIN_CHARS = int(os.getenv("MIN_CHARS", "50"))  # Более короткий текст возвращается как есть
+# Общий предел ожидания одного вызова summarize_text (rate limit, очередь, запрос), секунды
+SUMMARY_DEADLINE = float(os.getenv("SUMMARY_DEADLINE", "120"))
 
 # Rate Limiting настройки
 MAX_REQUESTS_PER_MINUTE = int(os.getenv("MAX_REQUESTS_PER_MINUTE", "8"))
 RATE_LIMIT_WINDOW = 60  # секунды
 
+# Адаптивный предел параллельных запросов (AIMD): растет на AIMD_INCREASE
+# после каждого успешного ответа и умножается на AIMD_DECREASE при 429/таймауте
+CONCURRENCY_MIN = 1
+CONCURRENCY_MAX = int(os.getenv("OPENAI_MAX_CONCURRENCY", "8"))
+AIMD_INCREASE = 0.5
+AIMD_DECREASE = 0.5
+# Интервал опроса свободного слота и чужого результата в async-версии, секунды
+SLOT_POLL_MIN = 0.005
+SLOT_POLL_MAX = 0.1
+
+# Неизменяемые части запроса создаются один раз при загрузке модуля
+_SYSTEM_MSG = {"role": "system", "content": SYSTEM_PROMPT}
+_BATCH_SYSTEM_MSG = {"role": "system", "content": BATCH_SYSTEM_PROMPT}
+_COMPLETION_KWARGS = {"model": MODEL_NAME, "max_tokens": 500, "temperature": 0.3}
+
+# Объединение запросов в пакеты: тексты, пришедшие в течение BATCH_WINDOW_MS,
+# отправляются одним запросом (0 - пакетирование выключено)
+BATCH_WINDOW_MS = int(os.getenv("BATCH_WINDOW_MS", "0"))
+BATCH_MAX_SIZE = int(os.getenv("BATCH_MAX_SIZE", "8"))
+
+# Статусы, после которых запрос повторяется (как в SDK OpenAI)
+_RETRYABLE_STATUSES = frozenset({408, 409, 429, 500, 502, 503, 504})
+
+# Статусы перегрузки сервера, при которых AIMD уменьшает предел параллельности
+_CONGESTION_STATUSES = frozenset({429, 503, 504})
+
+# Длительность в формате заголовков x-ratelimit-reset-*: "1s", "6m0s", "20ms"
+_DURATION_RE = re.compile(r'(\d+(?:\.\d+)?)(ms|h|m|s)')
+_DURATION_UNITS = {'h': 3600.0, 'm': 60.0, 's': 1.0, 'ms': 0.001}
+
 # Кэш настройки
 CACHE_MAX_SIZE = int(os.getenv("CACHE_MAX_SIZE", "200"))
 CACHE_TTL = int(os.getenv("CACHE_TTL", "3600"))  # 1 час
+CACHE_SHARDS = 16  # Число независимых сегментов кэша со своими блокировками
+CACHE_DIR = os.getenv("CACHE_DIR", "./.summary_cache")  # Дисковый кэш, переживает перезапуск
+CACHE_ZSTD_LEVEL = 3
+# Словарь zstd, обученный на резюме (zstandard.train_dictionary), для лучшего сжатия коротких текстов
+CACHE_ZSTD_DICT = os.getenv("CACHE_ZSTD_DICT")
 
 # Глобальные переменные для rate limiting и кэширования
-request_times = []
-cache: Dict[str, Dict[str, Any]] = {}
+# Token bucket: запас запросов пополняется равномерно в течение окна
+_bucket_tokens: float = MAX_REQUESTS_PER_MINUTE
+_bucket_last: float = time.monotonic()
+_refill_rate = MAX_REQUESTS_PER_MINUTE / RATE_LIMIT_WINDOW  # запросов в секунду
+
+# LRU-кэш с истечением по TTL, ключ - сам текст. Кэш разбит на сегменты
+# по хешу ключа, чтобы потоки с разными текстами не ждали друг друга
+_shard_size = -(-CACHE_MAX_SIZE // CACHE_SHARDS)
+_cache_shards: List[TTLCache] = [
+    TTLCache(maxsize=_shard_size, ttl=CACHE_TTL, timer=time.monotonic) for _ in range(CACHE_SHARDS)
+]
+_cache_locks: List[Lock] = [Lock() for _ in range(CACHE_SHARDS)]
+
+def _load_zstd_dict():
+    """Загружает словарь zstd для сжатия кэша, если он указан."""
+    if zstandard is None or not CACHE_ZSTD_DICT:
+        return None
+    try:
+        with open(CACHE_ZSTD_DICT, 'rb') as f:
+            return zstandard.ZstdCompressionDict(f.read())
+    except OSError as e:
+        logger.warning("Не удалось загрузить словарь zstd %s: %s", CACHE_ZSTD_DICT, e)
+        return None
+
+_zstd_dict = _load_zstd_dict()
+# Компрессоры zstd нельзя использовать из нескольких потоков одновременно
+_zstd_local = local()
+
+def _compress(result: str) -> Union[str, bytes]:
+    """Сжимает резюме для хранения в кэше (без zstandard возвращает как есть)."""
+    if zstandard is None:
+        return result
+    compressor = getattr(_zstd_local, 'compressor', None)
+    if compressor is None:
+        compressor = _zstd_local.compressor = zstandard.ZstdCompressor(
+            level=CACHE_ZSTD_LEVEL, dict_data=_zstd_dict
+        )
+    return compressor.compress(result.encode('utf-8'))
+
+def _decompress(value: Union[str, bytes]) -> str:
+    """Восстанавливает резюме из значения кэша."""
+    if isinstance(value, str):
+        return value
+    if zstandard is None:
+        raise ValueError("запись сжата zstd, но zstandard не установлен")
+    decompressor = getattr(_zstd_local, 'decompressor', None)
+    if decompressor is None:
+        decompressor = _zstd_local.decompressor = zstandard.ZstdDecompressor(dict_data=_zstd_dict)
+    return decompressor.decompress(value).decode('utf-8')
+
+def _open_disk_cache():
+    """Открывает дисковый кэш второго уровня, если diskcache установлен."""
+    if diskcache is None:
+        logger.info("diskcache не установлен, кэш резюме хранится только в памяти")
+        return None
+    try:
+        return diskcache.Cache(CACHE_DIR, size_limit=CACHE_MAX_SIZE * 1024 * 1024)
+    except Exception as e:
+        logger.warning("Не удалось открыть дисковый кэш %s: %s", CACHE_DIR, e)
+        return None
+
+# Второй уровень кэша на диске (SQLite): промахи в памяти ищутся здесь.
+# diskcache потокобезопасен и не требует внешней блокировки
+_disk_cache = _open_disk_cache()
 rate_limit_lock = Lock()
-cache_lock = Lock()
 
+# Тексты, резюме которых сейчас запрашивается у API: повторные вызовы
+# с тем же текстом ждут завершения первого вместо отдельного запроса
+_pending: Dict[str, Event] = {}
+_pending_lock = Lock()
+
+# Очередь текстов для пакетной отправки и ее обработчики (создаются при первом вызове)
+_batch_queue: "queue.Queue[Tuple[str, str, Future]]" = queue.Queue()
+_batch_thread: Optional[Thread] = None
+_batch_executor: Optional[ThreadPoolExecutor] = None
+_batch_lock = Lock()
+
+# Состояние AIMD-контроллера. У условия своя блокировка: пробуждения
+# ожидающих слот потоков не задерживают резервирование rate limit
+_max_concurrent: float = CONCURRENCY_MAX
+_inflight = 0
+_concurrency_cond = Condition(Lock())
+
+@functools.lru_cache(maxsize=1)
 def _get_openai_client() -> OpenAI:
-    """Создает и возвращает клиент OpenAI с настройками proxy."""
+    """
+    Создает клиент OpenAI с настройками proxy.
+    
+    Клиент создается один раз и переиспользуется всеми потоками,
+    чтобы не открывать новое TLS-соединение на каждый запрос.
+    Если ключ не задан, ошибка не кэшируется и возникнет при следующем вызове.
+    """
     api_key = os.getenv("OPENAI_API_KEY")
     if not api_key:
         raise ValueError("OPENAI_API_KEY не найден в переменных окружения")
     
+    # Повторы выполняет _complete, а не SDK: так каждая попытка и пауза
+    # между ними укладываются в дедлайн вызова.
+    # HTTP/2 позволяет мультиплексировать параллельные запросы в одном соединении
     return OpenAI(
         api_key=api_key,
-        base_url=PROXY_BASE_URL
+        base_url=PROXY_BASE_URL,
+        max_retries=0,
+        http_client=DefaultHttpxClient(http2=True)
+    )
+
+@functools.lru_cache(maxsize=1)
+def _get_async_openai_client() -> AsyncOpenAI:
+    """
+    Создает асинхронный клиент OpenAI с настройками proxy.
+    
+    Пул соединений клиента привязан к event loop, в котором он впервые
+    использован, поэтому summarize_text_async рассчитана на один
+    долгоживущий цикл событий приложения.
+    """
+    api_key = os.getenv("OPENAI_API_KEY")
+    if not api_key:
+        raise ValueError("OPENAI_API_KEY не найден в переменных окружения")
+    
+    return AsyncOpenAI(
+        api_key=api_key,
+        base_url=PROXY_BASE_URL,
+        max_retries=0,
+        http_client=DefaultAsyncHttpxClient(http2=True)
     )
 
-def _check_rate_limit() -> None:
-    """Проверяет rate limit и ожидает при необходимости."""
+def _refill_bucket() -> None:
+    """Пополняет token bucket за время с прошлого обращения (под rate_limit_lock)."""
+    global _bucket_tokens, _bucket_last
+    now = time.monotonic()
+    _bucket_tokens = min(
+        MAX_REQUESTS_PER_MINUTE,
+        _bucket_tokens + (now - _bucket_last) * _refill_rate
+    )
+    _bucket_last = now
+
+def _reserve_rate_limit() -> float:
+    """
+    Резервирует токен rate limit.
+    
+    Токен резервируется сразу: при нехватке запас уходит в минус,
+    и следующие вызовы ждут дольше, не занимая блокировку во время сна.
+    
+    Returns:
+        Сколько секунд нужно подождать перед запросом
+    """
+    global _bucket_tokens
+    
+    with rate_limit_lock:
+        _refill_bucket()
+        _bucket_tokens -= 1
+        wait_time = -_bucket_tokens / _refill_rate if _bucket_tokens < 0 else 0.0
+    
+    return wait_time
+
+def _release_rate_limit() -> None:
+    """Возвращает зарезервированный токен, если запрос так и не был отправлен."""
+    global _bucket_tokens
     with rate_limit_lock:
-        current_time = time.time()
-        
-        # Удаляем старые запросы
-        global request_times
-        request_times = [req_time for req_time in request_times 
-                        if current_time - req_time < RATE_LIMIT_WINDOW]
-        
-        # Если достигнут лимит, ждем
-        if len(request_times) >= MAX_REQUESTS_PER_MINUTE:
-            oldest_request = min(request_times)
-            wait_time = RATE_LIMIT_WINDOW - (current_time - oldest_request)
-            if wait_time > 0:
-                logger.warning(f"Достигнут rate limit. Ожидание {wait_time:.1f} секунд...")
-                time.sleep(wait_time)
-                current_time = time.time()
+        _bucket_tokens += 1
+
+def _remaining(deadline: float) -> float:
+    """
+    Возвращает время, оставшееся до дедлайна вызова.
+    
+    Raises:
+        TimeoutError: Если дедлайн уже истек
+    """
+    remaining = deadline - time.monotonic()
+    if remaining <= 0:
+        raise TimeoutError(f"Превышено время ожидания резюме ({SUMMARY_DEADLINE:g} с)")
+    return remaining
+
+def _rate_limit_wait(deadline: Optional[float]) -> float:
+    """
+    Резервирует токен rate limit с учетом дедлайна.
+    
+    Если ожидание не укладывается в дедлайн, токен возвращается
+    и сразу возникает TimeoutError вместо заведомо бесполезного сна.
+    """
+    wait_time = _reserve_rate_limit()
+    if deadline is not None and wait_time > 0 and wait_time >= deadline - time.monotonic():
+        _release_rate_limit()
+        raise TimeoutError(
+            f"Ожидание rate limit ({wait_time:.1f} с) превышает время на резюме ({SUMMARY_DEADLINE:g} с)"
+        )
+    if wait_time > 0:
+        logger.warning("Достигнут rate limit. Ожидание %.1f секунд...", wait_time)
+    return wait_time
+
+def _check_rate_limit(deadline: Optional[float] = None) -> None:
+    """Проверяет rate limit и ожидает при необходимости (не дольше дедлайна)."""
+    wait_time = _rate_limit_wait(deadline)
+    if wait_time > 0:
+        time.sleep(wait_time)
+
+async def _check_rate_limit_async(deadline: Optional[float] = None) -> None:
+    """Проверяет rate limit и ожидает, не блокируя цикл событий."""
+    wait_time = _rate_limit_wait(deadline)
+    if wait_time > 0:
+        await asyncio.sleep(wait_time)
+
+def _parse_duration(value: str) -> Optional[float]:
+    """Разбирает длительность вида "1m30s" или "20ms" в секунды."""
+    parts = _DURATION_RE.findall(value)
+    if not parts:
+        return None
+    return sum(float(number) * _DURATION_UNITS[unit] for number, unit in parts)
+
+def _get_retry_after(error: APIError) -> float:
+    """
+    Извлекает из ответа сервера, через сколько секунд можно повторить запрос.
+    
+    Args:
+        error: Ошибка API с HTTP-ответом
         
-        # Добавляем текущий запрос
-        request_times.append(current_time)
-
-def _get_cache_key(text: str) -> str:
-    """Генерирует ключ кэша для текста."""
-    return hashlib.md5(text.encode('utf-8')).hexdigest()
-
-def _get_from_cache(text: str) -> Optional[str]:
-    """Получает результат из кэша."""
-    with cache_lock:
-        key = _get_cache_key(text)
-        if key in cache:
-            item = cache[key]
-            if time.time() - item['timestamp'] < CACHE_TTL:
-                logger.info("Результат найден в кэше")
-                return item['result']
-            else:
-                del cache[key]
+    Returns:
+        Задержка в секундах (0, если сервер ее не указал)
+    """
+    response = getattr(error, 'response', None)
+    if response is None:
+        return 0.0
+    headers = response.headers
+    
+    hints = []
+    retry_after = headers.get('retry-after')
+    if retry_after:
+        try:
+            hints.append(float(retry_after))
+        except ValueError:
+            # Retry-After может быть HTTP-датой
+            try:
+                # Дата сравнивается с настенными часами; дальше задержка
+                # отсчитывается только по time.monotonic()
+                hints.append(parsedate_to_datetime(retry_after).timestamp() - time.time())
+            except (TypeError, ValueError):
+                pass
+    
+    reset_requests = headers.get('x-ratelimit-reset-requests')
+    if reset_requests:
+        reset = _parse_duration(reset_requests)
+        if reset is not None:
+            hints.append(reset)
+    
+    return max([0.0, *hints])
+
+def _defer_rate_limit(delay: float) -> None:
+    """
+    Откладывает следующие запросы на delay секунд.
+    
+    Запас token bucket уводится в минус ровно настолько, чтобы к концу
+    паузы накопился один токен: параллельные вызовы _check_rate_limit
+    ждут, пока сервер снова примет запросы, а повтор уходит сразу после нее.
+    Пауза слегка растянута случайной добавкой, чтобы процессы, получившие
+    429 одновременно, не вернулись разом, и вместе с ней ограничена MAX_BACKOFF.
+    """
+    global _bucket_tokens
+    if delay <= 0:
+        return
+    delay += random.uniform(0, delay / 2)
+    delay = min(delay, MAX_BACKOFF)
+    with rate_limit_lock:
+        _refill_bucket()
+        _bucket_tokens = min(_bucket_tokens, 1 - delay * _refill_rate)
+
+def _acquire_slot(timeout: Optional[float] = None) -> None:
+    """
+    Ждет, пока число запросов в работе станет меньше текущего предела.
+    
+    Raises:
+        TimeoutError: Если слот не освободился за timeout секунд
+    """
+    global _inflight
+    with _concurrency_cond:
+        if not _concurrency_cond.wait_for(lambda: _inflight < int(_max_concurrent), timeout):
+            raise TimeoutError(f"Превышено время ожидания резюме ({SUMMARY_DEADLINE:g} с)")
+        _inflight += 1
+
+def _try_acquire_slot() -> bool:
+    """Занимает слот без ожидания; возвращает False, если предел исчерпан."""
+    global _inflight
+    with _concurrency_cond:
+        if _inflight < int(_max_concurrent):
+            _inflight += 1
+            return True
+        return False
+
+async def _acquire_slot_async(deadline: float) -> None:
+    """
+    Ждет слот, не блокируя цикл событий.
+    
+    Счетчик опрашивается из самой задачи с нарастающей паузой: ожидание
+    не передается в поток, поэтому отмена задачи (asyncio.wait_for,
+    разрыв соединения) не оставляет занятый слот без владельца.
+    
+    Raises:
+        TimeoutError: Если слот не освободился до дедлайна
+    """
+    delay = SLOT_POLL_MIN
+    while not _try_acquire_slot():
+        await asyncio.sleep(min(delay, _remaining(deadline)))
+        delay = min(delay * 2, SLOT_POLL_MAX)
+
+async def _wait_event_async(event: Event, deadline: float) -> None:
+    """
+    Ждет установки события, не занимая поток пула.
+    
+    Как и _acquire_slot_async, опрашивает событие из самой задачи:
+    дублирующие вызовы не держат потоки asyncio.to_thread до дедлайна.
+    
+    Raises:
+        TimeoutError: Если событие не установлено до дедлайна
+    """
+    delay = SLOT_POLL_MIN
+    while not event.is_set():
+        await asyncio.sleep(min(delay, _remaining(deadline)))
+        delay = min(delay * 2, SLOT_POLL_MAX)
+
+def _release_slot(success: bool, congested: bool) -> None:
+    """
+    Освобождает слот и подстраивает предел параллельности.
+    
+    Args:
+        success: Запрос завершился успешно (предел растет аддитивно)
+        congested: Сервер перегружен - 429/503/504 или таймаут (предел уменьшается вдвое)
+    """
+    global _inflight, _max_concurrent
+    with _concurrency_cond:
+        _inflight -= 1
+        if congested:
+            _max_concurrent = max(CONCURRENCY_MIN, _max_concurrent * AIMD_DECREASE)
+        elif success:
+            _max_concurrent = min(CONCURRENCY_MAX, _max_concurrent + AIMD_INCREASE)
+        # Будим столько ожидающих, сколько слотов реально свободно
+        free_slots = int(_max_concurrent) - _inflight
+        if free_slots > 0:
+            _concurrency_cond.notify(free_slots)
+
+def _cache_key(text: str) -> str:
+    """
+    Нормализует текст для использования в качестве ключа кэша.
+    
+    Тексты, отличающиеся только формой Unicode (NFC) и пробелами,
+    получают один ключ. Регистр сохраняется: он может менять смысл.
+    """
+    return ' '.join(unicodedata.normalize('NFC', text).split())
+
+def _get_shard(key: str) -> Tuple[TTLCache, Lock]:
+    """Возвращает сегмент кэша и его блокировку для ключа."""
+    index = hash(key) % CACHE_SHARDS
+    return _cache_shards[index], _cache_locks[index]
+
+def _get_from_cache(key: str) -> Optional[str]:
+    """
+    Получает результат из кэша в памяти, а при промахе - с диска.
+    
+    Ключ должен быть получен через _cache_key: вызывающий нормализует
+    текст один раз и передает ключ во все обращения к кэшу.
+    
+    Запись, которую не удалось распаковать (другой словарь zstd,
+    zstandard не установлен, поврежденные данные), удаляется из обоих
+    уровней кэша и считается промахом.
+    """
+    shard, lock = _get_shard(key)
+    with lock:
+        value = shard.get(key)
+    if value is not None:
+        result = _decompress_entry(key, value)
+        if result is not None:
+            logger.info("Результат найден в кэше")
+        return result
+    
+    if _disk_cache is None:
+        return None
+    try:
+        value = _disk_cache.get(key)
+    except Exception as e:
+        logger.warning("Ошибка чтения дискового кэша: %s", e)
         return None
+    if value is None:
+        return None
+    
+    result = _decompress_entry(key, value)
+    if result is None:
+        return None
+    # Поднимаем запись в память, чтобы следующие обращения не шли на диск
+    with lock:
+        shard[key] = value
+    logger.info("Результат найден в дисковом кэше")
+    return result
+
+def _decompress_entry(key: str, value: Union[str, bytes]) -> Optional[str]:
+    """Распаковывает запись кэша; нечитаемую запись удаляет и возвращает None."""
+    try:
+        return _decompress(value)
+    except Exception as e:
+        logger.warning("Не удалось распаковать запись кэша, удаляем ее: %s", e)
+    shard, lock = _get_shard(key)
+    with lock:
+        shard.pop(key, None)
+    if _disk_cache is not None:
+        try:
+            _disk_cache.delete(key)
+        except Exception as e:
+            logger.warning("Ошибка удаления из дискового кэша: %s", e)
+    return None
+
+def _save_to_cache(key: str, result: str) -> None:
+    """Сохраняет результат под ключом _cache_key в память и на диск (в сжатом виде)."""
+    value = _compress(result)
+    shard, lock = _get_shard(key)
+    with lock:
+        shard[key] = value
+    
+    if _disk_cache is not None:
+        try:
+            _disk_cache.set(key, value, expire=CACHE_TTL)
+        except Exception as e:
+            logger.warning("Ошибка записи в дисковый кэш: %s", e)
+    logger.info("Результат сохранен в кэш")
+
+def _build_request(text: str) -> Dict[str, Any]:
+    """Формирует параметры запроса chat.completions для текста."""
+    return dict(
+        messages=[_SYSTEM_MSG, {"role": "user", "content": text}],
+        **_COMPLETION_KWARGS
+    )
+
+def _api_error(e: APIError, attempts: int) -> Exception:
+    """Логирует ошибку API и возвращает исключение для вызывающего кода."""
+    if isinstance(e, RateLimitError):
+        logger.warning("Превышен лимит запросов: %s", e)
+        return Exception(f"Превышен лимит запросов после {attempts} попыток. Попробуйте позже.")
+    
+    logger.error("Ошибка API: %s", e)
+    return Exception(f"Ошибка API после {attempts} попыток: {e}")
+
+def _is_retryable(e: APIError) -> bool:
+    """Проверяет, имеет ли смысл повторить запрос после ошибки."""
+    if isinstance(e, APIConnectionError):  # в том числе таймаут
+        return True
+    return isinstance(e, APIStatusError) and e.status_code in _RETRYABLE_STATUSES
 
-def _save_to_cache(text: str, result: str) -> None:
-    """Сохраняет результат в кэш."""
-    with cache_lock:
-        key = _get_cache_key(text)
+def _is_congestion(e: APIError) -> bool:
+    """
+    Проверяет, говорит ли ошибка о перегрузке сервера (сигнал AIMD уменьшить предел).
+    
+    Повторы выполняет _complete, поэтому AIMD видит результат каждой
+    попытки, а не только последней.
+    """
+    if isinstance(e, APITimeoutError):
+        return True
+    return isinstance(e, APIStatusError) and e.status_code in _CONGESTION_STATUSES
+
+def _retry_delay(attempt: int, e: APIError, deadline: Optional[float]) -> float:
+    """
+    Вычисляет паузу перед следующей попыткой и проверяет, что она укладывается в дедлайн.
+    
+    Пауза - экспоненциальная задержка со случайной добавкой, но не меньше
+    Retry-After из ответа сервера. При 429 пауза применяется ко всем
+    вызовам через token bucket, и отдельный сон не нужен (возвращается 0).
+    
+    Raises:
+        TimeoutError: Если до следующей попытки дедлайн истечет
+    """
+    backoff = min(BASE_DELAY * (2 ** attempt), MAX_BACKOFF)
+    delay = max(_get_retry_after(e), random.uniform(backoff / 2, backoff))
+    if deadline is not None and delay >= deadline - time.monotonic():
+        raise TimeoutError(
+            f"Пауза перед повтором ({delay:.1f} с) превышает время на резюме ({SUMMARY_DEADLINE:g} с)"
+        ) from e
+    
+    logger.warning("Попытка %d/%d не удалась: %s. Повтор через %.1f секунд",
+                   attempt + 1, MAX_RETRIES + 1, e, delay)
+    if isinstance(e, RateLimitError):
+        _defer_rate_limit(delay)
+        return 0.0
+    return delay
+
+def _complete(request: Dict[str, Any], deadline: Optional[float] = None) -> str:
+    """
+    Выполняет запрос chat.completions с повторами, учитывая rate limit и AIMD-предел.
+    
+    Перед каждой попыткой и каждой паузой проверяется оставшееся время,
+    а таймаут HTTP-запроса равен этому остатку, поэтому весь вызов
+    укладывается в дедлайн.
+    
+    Args:
+        request: Параметры запроса
+        deadline: Момент time.monotonic(), к которому нужно уложиться (None - без предела)
         
-        if len(cache) >= CACHE_MAX_SIZE:
-            oldest_key = min(cache.keys(), key=lambda k: cache[k]['timestamp'])
-            del cache[oldest_key]
+    Returns:
+        Текст ответа модели
         
-        cache[key] = {
-            'result': result,
-            'timestamp': time.time()
-        }
-        logger.info("Результат сохранен в кэш")
+    Raises:
+        TimeoutError: Если дедлайн истек
+        Exception: При ошибке API
+    """
+    client = _get_openai_client()
+    
+    for attempt in range(MAX_RETRIES + 1):
+        # Проверяем rate limit
+        _check_rate_limit(deadline)
+        
+        _acquire_slot(_remaining(deadline) if deadline is not None else None)
+        success = congested = False
+        try:
+            options = dict(request, timeout=_remaining(deadline)) if deadline is not None else request
+            response = client.chat.completions.create(**options)
+            success = True
+            return response.choices[0].message.content.strip()
+        except APIError as e:
+            congested = _is_congestion(e)
+            if attempt == MAX_RETRIES or not _is_retryable(e):
+                raise _api_error(e, attempt + 1)
+            error = e
+        finally:
+            _release_slot(success, congested)
+        
+        delay = _retry_delay(attempt, error, deadline)
+        if delay > 0:
+            time.sleep(delay)
 
-def summarize_text(text: str) -> str:
-    """Создает краткое резюме текста с помощью OpenAI API через proxy."""
-    # Проверяем кэш
-    cached_result = _get_from_cache(text)
-    if cached_result:
-        return cached_result
+def _build_batch_request(texts: List[str]) -> Dict[str, Any]:
+    """Формирует параметры одного запроса с несколькими текстами."""
+    return dict(
+        _COMPLETION_KWARGS,
+        messages=[
+            _BATCH_SYSTEM_MSG,
+            {"role": "user", "content": orjson.dumps({"docs": texts}).decode()}
+        ],
+        max_tokens=_COMPLETION_KWARGS["max_tokens"] * len(texts),
+        response_format={"type": "json_object"}
+    )
+
+def _summarize_single(text: str, key: str, deadline: Optional[float] = None) -> str:
+    """Запрашивает резюме одного текста и сохраняет его в кэш."""
+    logger.info("Создание резюме через OpenAI API")
+    result = _complete(_build_request(text), deadline)
     
-    # Проверяем rate limit
-    _check_rate_limit()
+    # Сохраняем в кэш
+    _save_to_cache(key, result)
     
-    client = _get_openai_client()
+    return result
+
+def _flush_batch(batch: List[Tuple[str, str, Future]], deadline: Optional[float] = None) -> None:
+    """
+    Отправляет пакет текстов одним запросом и раздает резюме ожидающим.
+    
+    Args:
+        batch: Тексты с ключами кэша и futures ожидающих вызовов
+        deadline: Срок по time.monotonic(); по умолчанию SUMMARY_DEADLINE
+            от начала отправки, чтобы зависший запрос не занимал поток пула
+    """
+    if deadline is None:
+        deadline = time.monotonic() + SUMMARY_DEADLINE
+    if len(batch) == 1:
+        text, key, future = batch[0]
+        try:
+            future.set_result(_summarize_single(text, key, deadline))
+        except Exception as e:
+            future.set_exception(e)
+        return
+    
+    texts = [text for text, _, _ in batch]
+    logger.info("Создание %d резюме одним запросом к OpenAI API", len(texts))
+    try:
+        content = _complete(_build_batch_request(texts), deadline)
+    except Exception as e:
+        for _, _, future in batch:
+            future.set_exception(e)
+        return
+    
+    try:
+        summaries = orjson.loads(content)["summaries"]
+        if len(summaries) != len(texts) or not all(isinstance(item, str) for item in summaries):
+            raise ValueError(f"ожидалось {len(texts)} резюме")
+    except (orjson.JSONDecodeError, KeyError, TypeError, ValueError) as e:
+        # Модель нарушила формат ответа: отправляем тексты по одному, параллельно
+        logger.warning("Не удалось разобрать пакетный ответ (%s), запросы отправляются по одному", e)
+        for item in batch:
+            _batch_executor.submit(_flush_batch, [item], deadline)
+        return
+    
+    for (_, key, future), summary in zip(batch, summaries):
+        summary = summary.strip()
+        _save_to_cache(key, summary)
+        future.set_result(summary)
+
+def _batch_worker() -> None:
+    """Собирает тексты из очереди в пакеты по времени и размеру."""
+    window = BATCH_WINDOW_MS / 1000
+    while True:
+        batch = [_batch_queue.get()]
+        deadline = time.monotonic() + window
+        while len(batch) < BATCH_MAX_SIZE:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(_batch_queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        # Сам запрос выполняется в пуле, чтобы сборщик сразу собирал следующий пакет
+        _batch_executor.submit(_flush_batch, batch)
+
+def _submit_to_batch(text: str, key: str) -> Future:
+    """Ставит текст в очередь пакетной отправки, запуская обработчик при необходимости."""
+    global _batch_thread, _batch_executor
+    with _batch_lock:
+        if _batch_thread is None:
+            _batch_executor = ThreadPoolExecutor(
+                max_workers=CONCURRENCY_MAX, thread_name_prefix="openai-batch"
+            )
+            _batch_thread = Thread(target=_batch_worker, name="openai-batcher", daemon=True)
+            _batch_thread.start()
     
-    for attempt in range(MAX_RETRIES):
+    future: Future = Future()
+    _batch_queue.put((text, key, future))
+    return future
+
+def _request_summary(text: str, key: str, deadline: float) -> str:
+    """Запрашивает резюме у OpenAI API и сохраняет его в кэш."""
+    if BATCH_WINDOW_MS > 0:
+        # Пакет обслуживает несколько вызовов, поэтому дедлайн ограничивает
+        # только ожидание результата; поздний ответ все равно попадет в кэш
         try:
-            logger.info(f"Попытка {attempt + 1}/{MAX_RETRIES} создания резюме")
-            
-            response = client.chat.completions.create(
-                model=MODEL_NAME,
-                messages=[
-                    {"role": "system", "content": SYSTEM_PROMPT},
-                    {"role": "user", "content": text}
-                ],
-                max_tokens=500,
-                temperature=0.3
+            return _submit_to_batch(text, key).result(timeout=_remaining(deadline))
+        except TimeoutError:
+            raise TimeoutError(f"Превышено время ожидания резюме ({SUMMARY_DEADLINE:g} с)")
+    return _summarize_single(text, key, deadline)
+
+async def _complete_async(request: Dict[str, Any], deadline: float) -> str:
+    """Асинхронный вариант _complete: те же повторы, паузы через asyncio.sleep."""
+    client = _get_async_openai_client()
+    
+    for attempt in range(MAX_RETRIES + 1):
+        await _check_rate_limit_async(deadline)
+        
+        await _acquire_slot_async(deadline)
+        success = congested = False
+        try:
+            response = await client.chat.completions.create(
+                **request, timeout=_remaining(deadline)
             )
-            
-            result = response.choices[0].message.content.strip()
-            
-            # Сохраняем в кэш
-            _save_to_cache(text, result)
-            
-            return result
-            
-        except RateLimitError as e:
-            logger.warning(f"Превышен лимит запросов (попытка {attempt + 1}/{MAX_RETRIES}): {e}")
-            
-            if attempt < MAX_RETRIES - 1:
-                delay = BASE_DELAY * (2 ** attempt)
-                logger.info(f"Ожидание {delay} секунд перед повторной попыткой...")
-                time.sleep(delay)
-                _check_rate_limit()
-            else:
-                raise Exception(f"Превышен лимит запросов после {MAX_RETRIES} попыток. Попробуйте позже.")
-                
+            success = True
+            return response.choices[0].message.content.strip()
         except APIError as e:
-            if "429" in str(e):
-                logger.warning(f"Ошибка 429 - Too many requests (попытка {attempt + 1}/{MAX_RETRIES}): {e}")
-                
-                if attempt < MAX_RETRIES - 1:
-                    delay = BASE_DELAY * (2 ** attempt)
-                    logger.info(f"Ожидание {delay} секунд перед повторной попыткой...")
-                    time.sleep(delay)
-                    _check_rate_limit()
-                else:
-                    raise Exception(f"Превышен лимит запросов после {MAX_RETRIES} попыток. Попробуйте позже.")
-            else:
-                logger.error(f"Ошибка API (попытка {attempt + 1}/{MAX_RETRIES}): {e}")
-                if attempt == MAX_RETRIES - 1:
-                    raise Exception(f"Ошибка API после {MAX_RETRIES} попыток: {e}")
-                time.sleep(BASE_DELAY)
-                
-        except Exception as e:
-            logger.error(f"Неожиданная ошибка (попытка {attempt + 1}/{MAX_RETRIES}): {e}")
-            if attempt == MAX_RETRIES - 1:
-                raise Exception(f"Неожиданная ошибка после {MAX_RETRIES} попыток: {e}")
-            time.sleep(BASE_DELAY)
\ No newline at end of file
+            congested = _is_congestion(e)
+            if attempt == MAX_RETRIES or not _is_retryable(e):
+                raise _api_error(e, attempt + 1)
+            error = e
+        finally:
+            _release_slot(success, congested)
+        
+        delay = _retry_delay(attempt, error, deadline)
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+async def _request_summary_async(text: str, key: str, deadline: float) -> str:
+    """Асинхронно запрашивает резюме у OpenAI API и сохраняет его в кэш."""
+    logger.info("Создание резюме через OpenAI API (async)")
+    result = await _complete_async(_build_request(text), deadline)
+    
+    _save_to_cache(key, result)
+    
+    return result
+
+def _short_circuit(text: str) -> Optional[str]:
+    """Возвращает результат для пустого или слишком короткого текста без обращения к API."""
+    stripped = text.strip() if text else ""
+    if len(stripped) < MIN_CHARS:
+        return stripped
+    return None
+
+def summarize_text(text: str) -> str:
+    """
+    Создает краткое резюме текста с помощью OpenAI API через proxy.
+    
+    Все ожидания внутри вызова (rate limit, слот, запрос к API) укладываются
+    в SUMMARY_DEADLINE секунд; при его превышении возникает TimeoutError.
+    """
+    # Текст короче резюме пересказывать незачем
+    short = _short_circuit(text)
+    if short is not None:
+        return short
+    
+    deadline = time.monotonic() + SUMMARY_DEADLINE
+    key = _cache_key(text)
+    while True:
+        # Проверяем кэш
+        cached_result = _get_from_cache(key)
+        if cached_result:
+            return cached_result
+        
+        with _pending_lock:
+            event = _pending.get(key)
+            if event is None:
+                event = _pending[key] = Event()
+                break
+        
+        # Этот текст уже обрабатывается другим потоком: ждем его результат.
+        # Если тот запрос завершился ошибкой, кэш пуст и попытку делаем сами
+        logger.info("Ожидание резюме того же текста из другого потока")
+        event.wait(_remaining(deadline))
+    
+    try:
+        # Предыдущий ведущий мог сохранить результат и снять регистрацию
+        # между нашей проверкой кэша и захватом _pending_lock
+        cached_result = _get_from_cache(key)
+        if cached_result:
+            return cached_result
+        return _request_summary(text, key, deadline)
+    finally:
+        with _pending_lock:
+            del _pending[key]
+        event.set()
+
+async def summarize_text_async(text: str) -> str:
+    """
+    Асинхронный вариант summarize_text.
+    
+    Использует AsyncOpenAI и asyncio.sleep, поэтому множество резюме
+    обрабатываются в одном цикле событий без отдельного потока на запрос.
+    Кэш, rate limit и AIMD-предел общие с синхронной версией.
+    """
+    short = _short_circuit(text)
+    if short is not None:
+        return short
+    
+    deadline = time.monotonic() + SUMMARY_DEADLINE
+    key = _cache_key(text)
+    while True:
+        cached_result = _get_from_cache(key)
+        if cached_result:
+            return cached_result
+        
+        with _pending_lock:
+            event = _pending.get(key)
+            if event is None:
+                event = _pending[key] = Event()
+                break
+        
+        logger.info("Ожидание резюме того же текста из другого запроса")
+        await _wait_event_async(event, deadline)
+    
+    try:
+        cached_result = _get_from_cache(key)
+        if cached_result:
+            return cached_result
+        return await _request_summary_async(text, key, deadline)
+    finally:
+        with _pending_lock:
+            del _pending[key]
+        event.set()
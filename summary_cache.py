@@ -0,0 +1,102 @@
+"""
+Модуль для кэширования резюме веб-страниц.
+
+Хранит резюме в SQLite вместе с ETag/Last-Modified страницы и хешем
+извлеченного текста. Это позволяет отвечать из кэша при ответе 304
+или при неизменившемся содержимом, не вызывая LLM повторно.
+"""
+
+import os
+import time
+import sqlite3
+import logging
+from threading import Lock
+from typing import Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+# Константы
+CACHE_DB_FILE = os.getenv("URL_CACHE_DB", "summary_cache.db")
+URL_CACHE_TTL = int(os.getenv("URL_CACHE_TTL", "86400"))  # 24 часа
+
+
+class SummaryCache:
+    """Персистентный кэш резюме по URL и хешу содержимого."""
+
+    def __init__(self, db_file: str = CACHE_DB_FILE, ttl: int = URL_CACHE_TTL):
+        self.db_file = db_file
+        self.ttl = ttl
+        self._lock = Lock()
+        self._conn = sqlite3.connect(db_file, check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        self._init_db()
+
+    def _init_db(self):
+        """Создает таблицу кэша, если она не существует."""
+        with self._lock, self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS cache (
+                    url TEXT PRIMARY KEY,
+                    etag TEXT,
+                    last_modified TEXT,
+                    content_hash BLOB,
+                    summary TEXT NOT NULL,
+                    ts INTEGER NOT NULL
+                )
+                """
+            )
+            self._conn.execute("CREATE INDEX IF NOT EXISTS idx_cache_content_hash ON cache (content_hash)")
+
+    def get(self, url: str) -> Optional[Dict]:
+        """Возвращает неустаревшую запись кэша для URL."""
+        # Метки времени хранятся в базе и переживают перезапуск, поэтому
+        # нужны настенные часы: time.monotonic() сбрасывается при перезагрузке
+        min_ts = int(time.time()) - self.ttl
+        try:
+            with self._lock:
+                row = self._conn.execute(
+                    "SELECT * FROM cache WHERE url = ? AND ts >= ?", (url, min_ts)
+                ).fetchone()
+        except sqlite3.Error as e:
+            logger.warning(f"Ошибка чтения кэша резюме: {e}")
+            return None
+        return dict(row) if row else None
+
+    def find_by_hash(self, content_hash: bytes) -> Optional[str]:
+        """Возвращает резюме для текста с указанным хешем, если оно есть в кэше."""
+        min_ts = int(time.time()) - self.ttl
+        try:
+            with self._lock:
+                row = self._conn.execute(
+                    "SELECT summary FROM cache WHERE content_hash = ? AND ts >= ? ORDER BY ts DESC LIMIT 1",
+                    (content_hash, min_ts)
+                ).fetchone()
+        except sqlite3.Error as e:
+            logger.warning(f"Ошибка чтения кэша резюме: {e}")
+            return None
+        return row['summary'] if row else None
+
+    def put(self, url: str, summary: str, content_hash: bytes,
+            etag: Optional[str] = None, last_modified: Optional[str] = None):
+        """Сохраняет резюме страницы в кэш."""
+        try:
+            with self._lock, self._conn:
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO cache (url, etag, last_modified, content_hash, summary, ts) "
+                    "VALUES (?, ?, ?, ?, ?, ?)",
+                    (url, etag, last_modified, content_hash, summary, int(time.time()))
+                )
+        except sqlite3.Error as e:
+            logger.warning(f"Ошибка записи в кэш резюме: {e}")
+
+    def clear(self):
+        """Очищает кэш."""
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM cache")
+        logger.info("Кэш резюме очищен")
+
+
+# Глобальный экземпляр кэша резюме
+summary_cache = SummaryCache()